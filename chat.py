@@ -8,6 +8,7 @@ from htbuilder.units import rem
 from dotenv import load_dotenv
 import streamlit as st
 import rdflib
+import gzip
 import os
 
 
@@ -22,6 +23,29 @@ openai_api_key = os.getenv("OPENAI_API_KEY")
 
 llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
 
+# Knowledge graph files that generate_graph.py can export
+GRAPH_FILES = [
+    "./data/processed/knowledge_graph.ttl",
+    "./data/processed/knowledge_graph.nt",
+    "./data/processed/knowledge_graph.ttl.gz",
+    "./data/processed/knowledge_graph.nt.gz",
+]
+
+def find_graph_file():
+    """
+    Return the most recently exported knowledge graph file.
+
+    Returns:
+        str: Path of the knowledge graph
+
+    Raises:
+        FileNotFoundError: If no knowledge graph was exported
+    """
+    graph_files = [graph_file for graph_file in GRAPH_FILES if os.path.exists(graph_file)]
+    if not graph_files:
+        raise FileNotFoundError("No knowledge graph found, run generate_graph.py first")
+    return max(graph_files, key=os.path.getmtime)
+
 def parse_uri(uri):
     clean_uri = str(uri)
     if "#" in clean_uri:
@@ -43,9 +67,15 @@ def execute_sparql_query(query: str):
         dict: {"vars": [...], "rows": [...], "row_count": int} or [] on error
     """
     # Load the graph
-    GRAPH_FILE = "./data/processed/knowledge_graph.ttl"
+    GRAPH_FILE = find_graph_file()
     g = rdflib.Graph()
-    g.parse(GRAPH_FILE, format="turtle")
+    # The format is given by the extension, e.g. knowledge_graph.nt.gz is gzip compressed N-Triples
+    graph_format = rdflib.util.guess_format(GRAPH_FILE.removesuffix(".gz"))
+    if GRAPH_FILE.endswith(".gz"):
+        with gzip.open(GRAPH_FILE, "rb") as f:
+            g.parse(f, format=graph_format)
+    else:
+        g.parse(GRAPH_FILE, format=graph_format)
 
     try:
         # Execute the query
@@ -1,4 +1,5 @@
 from rdflib.namespace import RDFS, XSD, RDF, SDO, FOAF
+from rdflib.compare import isomorphic
 from rdflib import Literal, Namespace, Graph
 import pandas as pd
 import requests
@@ -6,6 +7,8 @@ import tarfile
 import pathlib
 import pickle
 import rdflib
+import tempfile
+import gzip
 import os
 import re
 import json
@@ -30,6 +33,14 @@ OG = Namespace("http://www.oncograph.net/hospital-data/")
 NCIT = Namespace("https://evs.nci.nih.gov/ftp1/NCI_Thesaurus/Thesaurus_25.11d.OWL#")
 SCHEMA = Namespace("https://schema.org/")
 
+# Knowledge graph export settings
+# The streaming export writes the triples chunk by chunk instead of building the whole graph in memory
+EXPORT_STREAMING = True
+EXPORT_FORMAT = "ttl"  # "ttl" (Turtle) or "nt" (N-Triples)
+EXPORT_FORMATS = {"ttl": "turtle", "nt": "nt"}
+EXPORT_COMPRESS = False  # Write the knowledge graph as a gzip file
+EXPORT_CHUNK_SIZE = 10000  # Number of patients processed per chunk
+
 def get_ontology_code(concept: str) -> str:
     """
     Return the NCIT ontology code for a given diagnosis concept.
@@ -64,6 +75,189 @@ def get_ontology_code(concept: str) -> str:
         return "NO_MATCH"
 
 
+
+def patient_triples(patient: pd.Series) -> list:
+    """
+    Build the triples describing a patient and their diagnosis.
+
+    Args:
+        patient (pd.Series): Row of the completed clinical dataset.
+
+    Returns:
+        list: (subject, predicate, object) triples for the patient in the format
+              Patient -> hasDiagnosis -> NCIT:xxxx
+    """
+
+    # Unique Identifier for the patient
+    patient_id = patient["cases.submitter_id"]
+    patient_uri = OG[patient_id]
+    triples = [(patient_uri, RDF.type, SCHEMA.Patient)]
+
+    # Unique Identifier for the diagnosis
+    ncit_code_raw = patient["ncit_code"]
+    ncit_code = ncit_code_raw.split(":")[-1]
+    diagnosis_uri = NCIT[ncit_code]
+
+    # Link the patient to their diagnosis using the hasDiagnosis relationship
+    triples.append((patient_uri, OG.hasDiagnosis, diagnosis_uri))
+
+    patient_gender = patient['demographic.gender']
+    triples.append((patient_uri, SCHEMA.Gender, Literal(patient_gender, datatype=XSD.string)))
+
+    # pandas reads the age as int or float depending on missing values, so normalize it to an int
+    patient_age = patient['diagnoses.age_at_diagnosis']
+    if not pd.isna(patient_age):
+        triples.append((patient_uri, OG.ageAtDiagnosisDays, Literal(int(patient_age), datatype=XSD.integer)))
+
+    # Label the diagnosis identifier
+    primary_diagnosis = Literal(patient["diagnoses.primary_diagnosis"], datatype=XSD.string)
+    triples.append((diagnosis_uri, RDFS.label, primary_diagnosis))
+
+    disease_primary_site = str(patient['cases.primary_site'])
+    triples.append((patient_uri, OG.hasDiseasePrimarySite, Literal(disease_primary_site, datatype=XSD.string)))
+
+    return triples
+
+
+def new_graph() -> Graph:
+    """
+    Return an empty graph with the readable namespaces of the knowledge graph bound.
+
+    Returns:
+        Graph: The empty graph
+    """
+
+    g = Graph()
+    g.bind("ncit", NCIT)
+    g.bind("og", OG)
+    g.bind("schema", SCHEMA, override=True)
+    return g
+
+
+def open_graph_file(path: str, compress: bool, mode: str = "wb"):
+    """
+    Open a knowledge graph file in binary mode, optionally gzip compressed.
+
+    Args:
+        path (str): Location of the knowledge graph.
+        compress (bool): The file is a gzip file if True.
+        mode (str): "wb" to write the file, "rb" to read it.
+
+    Returns:
+        IO: The opened file
+    """
+
+    if compress:
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def build_graph(clinical_file: str) -> Graph:
+    """
+    Build the whole knowledge graph in memory from the completed clinical dataset.
+
+    Args:
+        clinical_file (str): Path of the completed clinical CSV file.
+
+    Returns:
+        Graph: The knowledge graph
+    """
+
+    g = new_graph()
+    df = pd.read_csv(clinical_file)
+    for _, patient in df.iterrows():
+        for triple in patient_triples(patient):
+            g.add(triple)
+    return g
+
+
+def save_graph(g: Graph, graph_file: str, export_format: str, compress: bool):
+    """
+    Serialize an in-memory knowledge graph on disk.
+
+    Args:
+        g (Graph): The knowledge graph.
+        graph_file (str): Destination of the knowledge graph.
+        export_format (str): "ttl" or "nt".
+        compress (bool): Write a gzip file if True.
+    """
+
+    with open_graph_file(graph_file, compress) as out:
+        g.serialize(destination=out, format=EXPORT_FORMATS[export_format], encoding="utf-8")
+
+
+def stream_graph(clinical_file: str, graph_file: str, export_format: str, compress: bool, chunk_size: int):
+    """
+    Write the knowledge graph on disk chunk by chunk, without building it in memory.
+
+    Each chunk of patients is added to a small graph which is serialized and appended
+    to the output, so memory is bounded by the chunk size. Turtle allows the @prefix
+    lines repeated by every chunk.
+
+    Args:
+        clinical_file (str): Path of the completed clinical CSV file.
+        graph_file (str): Destination of the knowledge graph.
+        export_format (str): "ttl" or "nt".
+        compress (bool): Write a gzip file if True.
+        chunk_size (int): Number of patients per chunk.
+    """
+
+    # The diagnosis labels are shared between patients, only write them once
+    seen_labels = set()
+    with open_graph_file(graph_file, compress) as out:
+        for chunk in pd.read_csv(clinical_file, chunksize=chunk_size):
+            chunk_graph = new_graph()
+            for _, patient in chunk.iterrows():
+                for triple in patient_triples(patient):
+                    if triple[1] == RDFS.label:
+                        if triple in seen_labels:
+                            continue
+                        seen_labels.add(triple)
+                    chunk_graph.add(triple)
+            out.write(chunk_graph.serialize(format=EXPORT_FORMATS[export_format], encoding="utf-8"))
+
+
+def check_graph_export():
+    """
+    Check that the streaming export writes the same graph as the in-memory export.
+
+    A few edge-case patients (identifiers that are not valid prefixed names, quotes and
+    newlines in literals, missing ages) are exported in every format, with and without
+    gzip, then parsed back and compared to the in-memory graph.
+
+    Raises:
+        ValueError: If an exported file does not match the in-memory graph
+    """
+
+    patients = pd.DataFrame({
+        "cases.submitter_id": ["AD1", "AD4.", "AD(5)", "AD/6", "AD7"],
+        "ncit_code": ["NCIT:C2852", "NCIT:C2852", "NCIT:C2929", "NO_MATCH", "NCIT:C2929"],
+        "demographic.gender": ["female", "male", "female", None, "male"],
+        "diagnoses.age_at_diagnosis": [21326, None, 100, 5000, None],
+        "diagnoses.primary_diagnosis": ["Adenocarcinoma, NOS", "Adenocarcinoma, NOS", 'Line\nbreak "quoted"', "Unknown", 'Line\nbreak "quoted"'],
+        "cases.primary_site": ["Colon", "Bronchus And Lung", None, "Breast\r", "Colon"],
+    })
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        clinical_file = os.path.join(tmp_dir, "clinical_df.csv")
+        patients.to_csv(clinical_file, index=False)
+        expected = build_graph(clinical_file)
+
+        for export_format, rdflib_format in EXPORT_FORMATS.items():
+            for compress in (False, True):
+                streamed_file = os.path.join(tmp_dir, f"streamed.{export_format}")
+                saved_file = os.path.join(tmp_dir, f"saved.{export_format}")
+                stream_graph(clinical_file, streamed_file, export_format, compress, chunk_size=2)
+                save_graph(expected, saved_file, export_format, compress)
+
+                for graph_file in (streamed_file, saved_file):
+                    g = Graph()
+                    with open_graph_file(graph_file, compress, "rb") as f:
+                        g.parse(f, format=rdflib_format)
+                    if not isomorphic(g, expected):
+                        raise ValueError(f"{graph_file} (compress={compress}) does not match the in-memory knowledge graph")
+
+
 with open(os.path.join(DATA_DIR, "manifest.txt")) as f:
     # Get the file IDs from the MANIFEST file
     print("Getting clinical file IDs...")
@@ -153,44 +347,23 @@ with open(f"{PROCESSED_DIR}/ontology_dict.pickle", "rb") as f:
     df.to_csv(f"{PROCESSED_DIR}/completed_clinical_df.csv", index=False)
 
 
-df = pd.read_csv(f"{PROCESSED_DIR}/completed_clinical_df.csv")
-
-#Initialize the Graph
-g = Graph()
-
-# Create the triples in the format
-# Patient -> hasDiagnosis -> NCIT:xxxx
-for _, patient in df.iterrows():
-    # Unique Identifier for the patient
-    patient_id = patient["cases.submitter_id"]
-    patient_uri = OG[patient_id]
-    g.add((patient_uri, RDF.type, SCHEMA.Patient))
-
-    # Unique Identifier for the diagnosis
-    ncit_code_raw = patient["ncit_code"]
-    ncit_code = ncit_code_raw.split(":")[-1]
-    diagnosis_uri = NCIT[ncit_code]
-
-    # Link the patient to their diagnosis using the hasDiagnosis relationship
-    g.add((patient_uri, OG.hasDiagnosis, diagnosis_uri))
-
-    patient_gender = patient['demographic.gender']
-    g.add((patient_uri, SCHEMA.Gender, Literal(patient_gender, datatype=XSD.string)))
-
-    patient_age = patient['diagnoses.age_at_diagnosis']
-    g.add((patient_uri, OG.ageAtDiagnosisDays, Literal(patient_age, datatype=XSD.integer)))
-
-    # Label the diagnosis identifier
-    primary_diagnosis = Literal(patient["diagnoses.primary_diagnosis"], datatype=XSD.string)
-    g.add((diagnosis_uri, RDFS.label, primary_diagnosis))
+clinical_file = f"{PROCESSED_DIR}/completed_clinical_df.csv"
+graph_file = os.path.join(PROCESSED_DIR, f"knowledge_graph.{EXPORT_FORMAT}")
+if EXPORT_COMPRESS:
+    graph_file += ".gz"
 
-    disease_primary_site = str(patient['cases.primary_site'])
-    g.add((patient_uri, OG.hasDiseasePrimarySite, Literal(disease_primary_site, datatype=XSD.string)))
+# Make sure the export writes a knowledge graph that can be loaded back
+check_graph_export()
 
-# Create Readable namespaces
-g.bind("ncit", NCIT)
-g.bind("og", OG)
-g.bind("schema", SCHEMA, override=True)
+if EXPORT_STREAMING:
+    # Free the clinical dataframes, the export re-reads the dataset chunk by chunk
+    del df, merged_clinical_df, dfs
 
-# Save the Knowledge Graph on disk
-g.serialize(destination=os.path.join(PROCESSED_DIR, "knowledge_graph.ttl"), format="turtle")
\ No newline at end of file
+    # Stream the triples to disk chunk by chunk, the graph is never held in memory
+    print(f"Streaming the knowledge graph to {graph_file}...")
+    stream_graph(clinical_file, graph_file, EXPORT_FORMAT, EXPORT_COMPRESS, EXPORT_CHUNK_SIZE)
+else:
+    # Save the Knowledge Graph on disk
+    print(f"Saving the knowledge graph to {graph_file}...")
+    save_graph(build_graph(clinical_file), graph_file, EXPORT_FORMAT, EXPORT_COMPRESS)
+print("Knowledge graph saved!")